@@ -4,8 +4,9 @@ Sodalite News Management Script
 Manages UI updates and news announcements for the Sodalite frontend
 """
 
-import json
+import orjson
 import argparse
+import os
 import sys
 from datetime import datetime, timedelta, timezone
 from typing import Dict, List, Any
@@ -38,22 +39,22 @@ NEWS_TYPES = {
     }
 }
 
-SEVERITY_LEVELS = ["low", "medium", "high", "critical"]
-COLORS = ["primary", "secondary", "destructive", "warning", "success"]
-ICONS = ["info", "alert-triangle", "wrench", "megaphone", "check-circle", "x-circle"]
+SEVERITY_LEVELS = ("low", "medium", "high", "critical")
+COLORS = ("primary", "secondary", "destructive", "warning", "success")
+ICONS = ("info", "alert-triangle", "wrench", "megaphone", "check-circle", "x-circle")
 
 def load_news_file(file_path: str = "ui_updates.json") -> Dict[str, Any]:
     """Load existing news file or create new structure"""
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        with open(file_path, 'rb') as f:
+            return orjson.loads(f.read())
     except FileNotFoundError:
         return {
             "version": "1.0.0",
             "last_updated": datetime.utcnow().isoformat() + "Z",
             "news": []
         }
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         print(f"Error: Invalid JSON in {file_path}: {e}")
         sys.exit(1)
 
@@ -61,8 +62,11 @@ def save_news_file(data: Dict[str, Any], file_path: str = "ui_updates.json") ->
     """Save news data to file"""
     data["last_updated"] = datetime.utcnow().isoformat() + "Z"
 
-    with open(file_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    # write to a temp file and swap it in, so a crash never leaves a half-written file
+    tmp_path = file_path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    os.replace(tmp_path, file_path)
 
     print(f"✅ News updated successfully! Saved to {file_path}")
 
@@ -96,11 +100,19 @@ def add_news_item(
         "message": message,
         "timestamp": timestamp.isoformat() + "Z",
         "expires": expires.isoformat() + "Z",
+        "expires_ts": expires.replace(tzinfo=timezone.utc).timestamp(),
         "show_when_offline": show_when_offline if show_when_offline is not None else defaults["show_when_offline"],
         "icon": icon or defaults["icon"],
         "color": color or defaults["color"]
     }
 
+def get_expires_ts(item: Dict[str, Any]) -> float:
+    """Get an item's expiration as epoch seconds, parsing legacy items without expires_ts"""
+    expires_ts = item.get("expires_ts")
+    if expires_ts is None:
+        expires_ts = datetime.fromisoformat(item["expires"].replace("Z", "+00:00")).timestamp()
+    return expires_ts
+
 def list_news_items(data: Dict[str, Any], show_expired: bool = False) -> None:
     """List all news items"""
     news_items = data.get("news", [])
@@ -109,16 +121,12 @@ def list_news_items(data: Dict[str, Any], show_expired: bool = False) -> None:
         print("📰 No news items found.")
         return
 
-    now = datetime.now(timezone.utc)
-    active_items = []
-    expired_items = []
-
-    for item in news_items:
-        expires = datetime.fromisoformat(item["expires"].replace("Z", "+00:00"))
-        if expires > now:
-            active_items.append(item)
-        else:
-            expired_items.append(item)
+    now_ts = datetime.now(timezone.utc).timestamp()
+    active_items = [item for item in news_items if get_expires_ts(item) > now_ts]
+    # expired items are only materialized when they're going to be shown
+    expired_items = [
+        item for item in news_items if get_expires_ts(item) <= now_ts
+    ] if show_expired else []
 
     print(f"📰 News Items (Last updated: {data.get('last_updated', 'Unknown')})")
     print("=" * 60)
@@ -131,7 +139,7 @@ def list_news_items(data: Dict[str, Any], show_expired: bool = False) -> None:
             print(f"    Message: {item['message'][:80]}{'...' if len(item['message']) > 80 else ''}")
             print()
 
-    if expired_items and show_expired:
+    if expired_items:
         print(f"\n🔴 Expired Items ({len(expired_items)}):")
         for item in expired_items:
             print(f"  • [{item['severity'].upper()}] {item['title']}")
@@ -149,13 +157,13 @@ def remove_news_item(data: Dict[str, Any], item_id: str) -> bool:
 
 def cleanup_expired(data: Dict[str, Any]) -> int:
     """Remove expired news items"""
-    now = datetime.now(timezone.utc)
+    now_ts = datetime.now(timezone.utc).timestamp()
     news_items = data.get("news", [])
     original_length = len(news_items)
 
     data["news"] = [
         item for item in news_items
-        if datetime.fromisoformat(item["expires"].replace("Z", "+00:00")) > now
+        if get_expires_ts(item) > now_ts
     ]
 
     removed_count = original_length - len(data["news"])
@@ -171,7 +179,7 @@ def main():
     add_parser = subparsers.add_parser("add", help="Add a news item")
     add_parser.add_argument("title", help="News title")
     add_parser.add_argument("message", help="News message")
-    add_parser.add_argument("--type", choices=list(NEWS_TYPES.keys()),
+    add_parser.add_argument("--type", choices=tuple(NEWS_TYPES),
                            default="announcement", help="News type")
     add_parser.add_argument("--severity", choices=SEVERITY_LEVELS, help="Severity level")
     add_parser.add_argument("--hours", type=int, default=24, help="Duration in hours")
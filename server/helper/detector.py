@@ -2,6 +2,24 @@
 sodalite service detector
 """
 
+# (needle, service) pairs, checked in order
+_RULES = (
+    # instagram division
+    ("instagram.com/reel", "instagram"),
+    ("instagram.com/p", "instagram"),
+
+    # youtube division
+    # ("youtube.com/watch", "youtube"),
+    # ("youtu.be/", "youtube"),
+    # ("youtube.com/shorts", "youtube"),
+    # ("music.youtube.com/", "youtube"),
+    # unsupported.
+
+    # tiktok division
+    ("tiktok.com/", "tiktok"),
+)
+
+
 def detect_service(url: str) -> str:
     """
     Detects the service based on the URL.
@@ -12,29 +30,8 @@ def detect_service(url: str) -> str:
     Returns:
         str: The name of the service if detected, otherwise 'unknown'.
     """
-
-    # instagram division
-    if (
-        "instagram.com/reel" in url
-        or "instagram.com/p" in url
-    ):
-        return "instagram"
-
-    # youtube division
-    # if (
-    #     "youtube.com/watch" in url
-    #     or "youtu.be/" in url
-    #     or "youtube.com/shorts" in url
-    #     or "music.youtube.com/" in url
-    # ):
-    #     return "youtube"
-    # unsupported.
-
-    # tiktok division
-    if (
-        "tiktok.com/" in url
-    ):
-        return "tiktok"
-
+    for needle, service in _RULES:
+        if needle in url:
+            return service
 
     return "unknown"
@@ -3,13 +3,123 @@ sodalite downloader - handles downloading and merging with ffmpeg
 """
 
 import os
+import errno
 import asyncio
 import tempfile
-import subprocess
+import shutil
+import uuid
 import unicodedata
 import re
-from typing import Optional, Tuple, Callable
+import aiofiles
+from typing import Optional, Tuple, Callable, Union
 from server.models.metadata import SodaliteMetadata, Video, Audio
+from server.helper.http import get_session
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# range downloads: part size and how many parts of one stream run at once
+RANGE_PART_SIZE = 8 * 1024 * 1024
+RANGE_CONNECTIONS = 4
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+
+_UNSAFE_CHARS_RE = re.compile(r'[^\w\s-]')
+_SEPARATORS_RE = re.compile(r'[-\s]+')
+
+# resolved once at import, download_and_merge retries the lookup while it's missing
+_ffmpeg_path: Optional[str] = shutil.which("ffmpeg")
+
+# ffmpeg codec args per output format, anything not listed uses the default
+VIDEO_CODEC_ARGS = {
+    "webm": ("-c:v", "libvpx-vp9", "-row-mt", "1",
+             "-deadline", "realtime", "-cpu-used", "4"),
+}
+DEFAULT_VIDEO_CODEC_ARGS = ("-c:v", "copy")
+
+AUDIO_CODEC_ARGS = {
+    "webm": ("-c:a", "libopus"),
+    "opus": ("-c:a", "libopus"),
+    "ogg": ("-c:a", "libopus"),
+    "mp3": ("-c:a", "libmp3lame", "-b:a", "192k"),
+    "flac": ("-c:a", "flac"),
+    "wav": ("-c:a", "pcm_s16le"),
+}
+DEFAULT_AUDIO_CODEC_ARGS = ("-c:a", "aac", "-b:a", "192k")
+
+# codec string prefixes (as the services report them) and their family
+CODEC_FAMILIES = (
+    ("vp09", "vp9"),
+    ("vp9", "vp9"),
+    ("vp8", "vp8"),
+    ("av01", "av1"),
+    ("av1", "av1"),
+    ("avc", "h264"),
+    ("h264", "h264"),
+    ("mp4a", "aac"),
+    ("m4a", "aac"),
+    ("aac", "aac"),
+    ("opus", "opus"),
+    ("vorbis", "vorbis"),
+    ("mp3", "mp3"),
+    ("flac", "flac"),
+)
+
+# (output format, source codec family) pairs that can be copied as-is
+VIDEO_COPY_COMPATIBLE = frozenset({
+    ("webm", "vp9"),
+    ("webm", "vp8"),
+    ("webm", "av1"),
+})
+AUDIO_COPY_COMPATIBLE = frozenset({
+    ("mp4", "aac"),
+    ("m4a", "aac"),
+    ("mkv", "aac"),
+    ("mkv", "opus"),
+    ("mkv", "vorbis"),
+    ("webm", "opus"),
+    ("webm", "vorbis"),
+    ("opus", "opus"),
+    ("ogg", "opus"),
+    ("ogg", "vorbis"),
+    ("mp3", "mp3"),
+    ("flac", "flac"),
+})
+
+# input options: our inputs are single clean cdn tracks, so probing 32K and
+# half a second (in microseconds - 0 would mean ffmpeg's 5s default) is
+# enough for ffmpeg to find the stream parameters. the larger packet queue
+# keeps one input's demuxer from stalling while the other catches up
+FFMPEG_INPUT_ARGS = ("-probesize", "32K", "-analyzeduration", "500000",
+                     "-thread_queue_size", "1024")
+
+ENCODER_METADATA_ARGS = ("-metadata", "encoder=sodalite")
+
+# http input options for ffmpeg's direct path: retry a dropped connection
+# (a cut-off body counts as one) at the current offset, a few seconds at most
+FFMPEG_RECONNECT_ARGS = ("-reconnect", "1", "-reconnect_delay_max", "5")
+
+# seconds ffmpeg may go without reporting progress before it's killed
+FFMPEG_STALL_TIMEOUT = 60
+# hard cap on one ffmpeg run, progress or not - a trickling http input keeps
+# reporting progress, and main fails tasks as stuck after 600 seconds
+FFMPEG_MAX_DURATION = 300
+
+# intermediate tracks are written once and read once by ffmpeg, so keep them
+# in ram when there's room. only the merged output lands in output_dir
+SHM_DIR = "/dev/shm"
+SHM_MIN_FREE_BYTES = 1024 * 1024 * 1024
+
+
+def _scratch_dir() -> Optional[str]:
+    """
+    picks where intermediate files go - /dev/shm if it exists and has room,
+    otherwise None so tempfile falls back to the system temp dir
+    """
+    try:
+        st = os.statvfs(SHM_DIR)
+    except OSError:
+        return None
+    if st.f_bavail * st.f_frsize < SHM_MIN_FREE_BYTES or not os.access(SHM_DIR, os.W_OK):
+        return None
+    return SHM_DIR
 
 
 def sanitize_filename(filename: str) -> str:
@@ -20,40 +130,190 @@ def sanitize_filename(filename: str) -> str:
     - replaces spaces with underscores
     - limits length to 200 characters
     """
-    filename = unicodedata.normalize('NFKD', filename).encode(
-        'ascii', 'ignore').decode('ascii')
-    filename = re.sub(r'[^\w\s-]', '', filename).strip()
-    filename = re.sub(r'[-\s]+', '_', filename)
+    # nfkd leaves plain ascii untouched, so most titles can skip the fold
+    if not filename.isascii():
+        filename = unicodedata.normalize('NFKD', filename).encode(
+            'ascii', 'ignore').decode('ascii')
+    filename = _UNSAFE_CHARS_RE.sub('', filename).strip()
+    filename = _SEPARATORS_RE.sub('_', filename)
     return filename[:200]
 
 
+async def _write_body(response, file) -> int:
+    """
+    write a response body to an open file and return bytes written
+    """
+    written = 0
+    # take whatever the socket has ready and only hit the disk once a full
+    # chunk has built up. the buffer is allocated once and filled in place
+    buffer = memoryview(bytearray(DOWNLOAD_CHUNK_SIZE))
+    filled = 0
+    while chunk := await response.content.readany():
+        size = len(chunk)
+        written += size
+        if filled + size > DOWNLOAD_CHUNK_SIZE:
+            await file.write(buffer[:filled])
+            filled = 0
+            if size > DOWNLOAD_CHUNK_SIZE:
+                await file.write(chunk)
+                continue
+        buffer[filled:filled + size] = chunk
+        filled += size
+    if filled:
+        await file.write(buffer[:filled])
+    return written
+
+
+def _content_range_total(response) -> Optional[int]:
+    """
+    total size from a 206 response's content-range header, if known
+    """
+    if response.status != 206:
+        return None
+    _, _, total = response.headers.get('Content-Range', '').rpartition('/')
+    return int(total) if total.isdigit() else None
+
+
+async def _download_rest(
+    session,
+    url: str,
+    output_path: str,
+    headers: dict,
+    offset: int
+) -> int:
+    """
+    fetch everything after offset with one open-ended range, for servers that
+    answer 206 without saying how big the file is. returns the file's size
+    """
+    rest_headers = {**headers, 'Range': f"bytes={offset}-"}
+    async with session.get(url, headers=rest_headers, timeout=60) as response:
+        if response.status == 416:
+            # nothing past offset, the first part was the whole file
+            return offset
+        response.raise_for_status()
+        if response.status == 206:
+            content_range = response.headers.get('Content-Range', '')
+            if not content_range.startswith(f"bytes {offset}-"):
+                raise RuntimeError(
+                    f"asked for bytes {offset}- but got {content_range or 'no content-range'}")
+            async with aiofiles.open(output_path, 'r+b') as file:
+                await file.seek(offset)
+                return offset + await _write_body(response, file)
+        # the server sent the whole body instead, start over with it
+        async with aiofiles.open(output_path, 'wb') as file:
+            return await _write_body(response, file)
+
+
+async def _preallocate(file, size: int):
+    """
+    size the file up front so the range parts can land at their offsets,
+    reserving real blocks where the os supports it to keep extents contiguous.
+    running out of space (ENOSPC) is raised here, before any range is fetched
+    """
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            await asyncio.to_thread(os.posix_fallocate, file.fileno(), 0, size)
+            return
+        except OSError as e:
+            # only filesystems without fallocate support get the sparse file
+            if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL):
+                raise
+    await file.truncate(size)
+
+
+async def _download_range(
+    session,
+    url: str,
+    output_path: str,
+    headers: dict,
+    start: int,
+    end: int,
+    limit: asyncio.Semaphore
+) -> int:
+    """
+    download bytes start..end (inclusive) into their place in output_path
+    """
+    async with limit:
+        range_headers = {**headers, 'Range': f"bytes={start}-{end}"}
+        async with session.get(url, headers=range_headers, timeout=60) as response:
+            response.raise_for_status()
+            if response.status != 206:
+                raise RuntimeError(
+                    f"server ignored range {start}-{end}, status {response.status}")
+            async with aiofiles.open(output_path, 'r+b') as file:
+                await file.seek(start)
+                written = await _write_body(response, file)
+
+    if written != end - start + 1:
+        raise RuntimeError(
+            f"range {start}-{end} returned {written} bytes")
+    return written
+
+
 async def download_stream(url: str, output_path: str, headers: Optional[dict] = None) -> int:
     """
-    download a stream to a file and return bytes downloaded
+    download a stream to a file and return bytes downloaded, 0 on failure.
+    running out of space raises instead. when the server supports ranges,
+    the rest of the file after the first part is fetched over several
+    connections at once
     """
-    import aiohttp
     print(f"DEBUG: Attempting to download stream from: {url[:100]}...")
-    headers = headers or {}
-    headers.update({
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-    })
+    headers = {**(headers or {}), 'User-Agent': USER_AGENT}
     print(f"DEBUG: Using headers: {list(headers.keys())}")
 
     downloaded_bytes = 0
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, timeout=60) as response:
-                print(
-                    f"DEBUG: Received HTTP status: {response.status} for URL: {url[:100]}...")
-                response.raise_for_status()
-                with open(output_path, 'wb') as file:
-                    async for chunk in response.content.iter_chunked(8192):
-                        file.write(chunk)
-                        downloaded_bytes += len(chunk)
+        session = await get_session()
+        # ask for the first part only, servers without range support just
+        # answer 200 with the whole body
+        first_headers = {**headers, 'Range': f"bytes=0-{RANGE_PART_SIZE - 1}"}
+        async with session.get(url, headers=first_headers, timeout=60) as response:
+            print(
+                f"DEBUG: Received HTTP status: {response.status} for URL: {url[:100]}...")
+            response.raise_for_status()
+            partial = response.status == 206
+            total_bytes = _content_range_total(response)
+            async with aiofiles.open(output_path, 'wb') as file:
+                downloaded_bytes = await _write_body(response, file)
+                if total_bytes and total_bytes > downloaded_bytes:
+                    await _preallocate(file, total_bytes)
+
+        if partial and total_bytes is None and downloaded_bytes == RANGE_PART_SIZE:
+            # a full first part of unknown total (bytes 0-n/*) may not be
+            # the end, so read on until the server runs out
+            print("DEBUG: Total size unknown, fetching the rest in one request")
+            downloaded_bytes = await _download_rest(
+                session, url, output_path, headers, downloaded_bytes)
+        elif total_bytes and total_bytes > downloaded_bytes:
+            limit = asyncio.Semaphore(RANGE_CONNECTIONS)
+            ranges = [
+                (start, min(start + RANGE_PART_SIZE, total_bytes) - 1)
+                for start in range(downloaded_bytes, total_bytes, RANGE_PART_SIZE)
+            ]
+            print(
+                f"DEBUG: Fetching remaining {total_bytes - downloaded_bytes} bytes in {len(ranges)} ranges")
+            parts = [
+                asyncio.create_task(_download_range(
+                    session, url, output_path, headers, start, end, limit))
+                for start, end in ranges
+            ]
+            try:
+                results = await asyncio.gather(*parts)
+            except BaseException:
+                # one bad part fails the stream, stop the rest from fetching
+                # and writing into a file that's about to be thrown away
+                for part in parts:
+                    part.cancel()
+                await asyncio.gather(*parts, return_exceptions=True)
+                raise
+            downloaded_bytes += sum(results)
         print(
             f"DEBUG: Successfully downloaded {downloaded_bytes} bytes to {os.path.basename(output_path)}")
     except Exception as e:
         print(f"ERROR: Failed to download stream {url[:100]}...: {e}")
+        if isinstance(e, OSError) and e.errno == errno.ENOSPC:
+            # not the stream's fault, the caller may have somewhere bigger
+            raise
         return 0
 
     return downloaded_bytes
@@ -72,168 +332,405 @@ def get_best_streams(
 
     if metadata.videos:
         if video_quality:
-            for v in metadata.videos:
-                if v.quality == video_quality:
-                    video = v
-                    break
+            video = metadata.videos_by_quality.get(video_quality)
         if not video:
             video = metadata.videos[0]
 
     if metadata.audios:
         if audio_quality:
-            for a in metadata.audios:
-                if a.quality == audio_quality:
-                    audio = a
-                    break
+            audio = metadata.audios_by_quality.get(audio_quality)
         if not audio:
             audio = metadata.audios[0]
 
     return video, audio
 
 
-async def download_and_merge(
+def _can_read_directly(stream: Optional[Union[Video, Audio]]) -> bool:
+    """
+    whether ffmpeg can pull a stream straight from its url. headers have to
+    fit into ffmpeg's -headers option, so no embedded line breaks
+    """
+    if stream is None:
+        return True
+    if not stream.url:
+        return False
+    return not any(
+        '\r' in f"{key}{value}" or '\n' in f"{key}{value}"
+        for key, value in (stream.headers or {}).items()
+    )
+
+
+def _direct_input_args(stream: Union[Video, Audio]) -> list[str]:
+    """
+    ffmpeg input args that read a stream over http with the same headers
+    download_stream would send
+    """
+    headers = {
+        key: value for key, value in (stream.headers or {}).items()
+        if key.lower() != 'user-agent'
+    }
+    args = ["-user_agent", USER_AGENT]
+    if headers:
+        args.extend([
+            "-headers",
+            "".join(f"{key}: {value}\r\n" for key, value in headers.items())
+        ])
+    args.extend([*FFMPEG_RECONNECT_ARGS, *FFMPEG_INPUT_ARGS,
+                 "-i", str(stream.url)])
+    return args
+
+
+def _codec_family(codec: Optional[str]) -> Optional[str]:
+    """
+    normalize a codec string like 'vp09.00.40.08' to its family
+    """
+    if not codec:
+        return None
+    codec = codec.lower()
+    for prefix, family in CODEC_FAMILIES:
+        if codec.startswith(prefix):
+            return family
+    return None
+
+
+def build_ffmpeg_cmd(
+    input_args: list[str],
     metadata: SodaliteMetadata,
-    video_quality: Optional[str] = None,
-    audio_quality: Optional[str] = None,
-    output_format: str = "mp4",
-    output_dir: str = None,
-    download_mode: str = "default",
-    task_id: Optional[str] = None,
-    progress_callback: Optional[Callable[[str], None]] = None
-) -> tuple[str, int]:
+    video: Optional[Video],
+    audio: Optional[Audio],
+    output_format: str,
+    output_path: str
+) -> list[str]:
     """
-    download video and audio streams, merge them with ffmpeg, and inject metadata
+    build the ffmpeg command that merges the inputs and injects metadata
     """
+    # -xerror: a read error on an input fails the run instead of being taken
+    # as the end of that input, which would pass a truncated file as done
+    ffmpeg_cmd = [_ffmpeg_path or "ffmpeg", "-y", "-loglevel", "error",
+                  "-xerror", "-progress", "pipe:1", "-nostats"]
+    ffmpeg_cmd.extend(input_args)
+
+    codec_args = []
+    if video:
+        if (output_format, _codec_family(video.codec)) in VIDEO_COPY_COMPATIBLE:
+            codec_args.extend(("-c:v", "copy"))
+        else:
+            codec_args.extend(VIDEO_CODEC_ARGS.get(
+                output_format, DEFAULT_VIDEO_CODEC_ARGS))
+    if audio:
+        if (output_format, _codec_family(audio.codec)) in AUDIO_COPY_COMPATIBLE:
+            codec_args.extend(("-c:a", "copy"))
+        else:
+            codec_args.extend(AUDIO_CODEC_ARGS.get(
+                output_format, DEFAULT_AUDIO_CODEC_ARGS))
+    ffmpeg_cmd.extend(codec_args)
+    # let encoders use every core, pointless when everything is copied
+    if any(codec_args[i + 1] != "copy" for i, arg in enumerate(codec_args)
+           if arg in ("-c:v", "-c:a")):
+        ffmpeg_cmd.extend(["-threads", "0"])
+
+    metadata_args = [
+        "-metadata", f"comment=Downloaded with sodalite from {metadata.service}",
+        *ENCODER_METADATA_ARGS
+    ]
+    if metadata.title:
+        metadata_args.extend(["-metadata", f"title={metadata.title}"])
+    if metadata.author:
+        metadata_args.extend(["-metadata", f"artist={metadata.author}"])
+    ffmpeg_cmd.extend(metadata_args)
+
+    if output_format == "mp4":
+        ffmpeg_cmd.extend(["-movflags", "+faststart"])
+
+    ffmpeg_cmd.append(output_path)
+    return ffmpeg_cmd
+
+
+def _remove_partial(path: str):
+    """delete a half-written output so a failed job leaves nothing behind"""
     try:
-        subprocess.run(["ffmpeg", "-version"],
-                       capture_output=True, check=True, timeout=5)
-    except (subprocess.CalledProcessError, FileNotFoundError, subprocess.TimeoutExpired):
-        raise RuntimeError(
-            "ffmpeg is not installed or not in PATH. please install ffmpeg.")
-
-    if output_dir is None:
-        output_dir = tempfile.gettempdir()
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"WARNING: Could not remove partial output {path}: {e}")
 
-    total_downloaded_bytes = 0
 
-    with tempfile.TemporaryDirectory(prefix="sodalite_") as temp_dir:
-        base_filename = sanitize_filename(
-            f"{metadata.title}_{metadata.author}")
-        output_filename = f"{base_filename}.{output_format}"
-        output_path = os.path.join(output_dir, output_filename)
+def _loggable_cmd(ffmpeg_cmd: list[str]) -> str:
+    """
+    the ffmpeg command for the logs - header values (session cookies) are
+    reduced to their names and stream urls are cut short, like
+    download_stream logs them
+    """
+    shown = []
+    previous = None
+    for arg in ffmpeg_cmd:
+        if previous == "-headers":
+            names = [line.split(":", 1)[0] for line in arg.split("\r\n") if line]
+            arg = f"<headers: {names}>"
+        elif previous == "-i" and arg.startswith(("http://", "https://")):
+            arg = f"{arg[:100]}..."
+        shown.append(arg)
+        previous = arg if arg in ("-headers", "-i") else None
+    return ' '.join(shown)
+
+
+async def run_ffmpeg(ffmpeg_cmd: list[str]) -> tuple[int, str]:
+    """
+    run ffmpeg and return its exit code and stderr
+    """
+    print(f"DEBUG: Executing FFmpeg command: {_loggable_cmd(ffmpeg_cmd)}")
+    # stderr only matters when ffmpeg fails, so it goes to a file that is
+    # read back on a non-zero exit instead of being piped through python
+    with tempfile.TemporaryFile() as errlog:
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *ffmpeg_cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=errlog
+            )
+        except Exception as e:
+            print(
+                f"ERROR: An unexpected error occurred during FFmpeg execution: {e}")
+            return 1, f"Execution error: {str(e)}"
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + FFMPEG_MAX_DURATION
+        try:
+            # ffmpeg writes a progress block to stdout every half second while
+            # it makes progress, so a quiet stdout means it has stalled
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    print(
+                        f"ERROR: FFmpeg ran longer than {FFMPEG_MAX_DURATION} seconds.")
+                    return 1, "Processing timeout"
+                try:
+                    line = await asyncio.wait_for(
+                        process.stdout.readline(),
+                        timeout=min(FFMPEG_STALL_TIMEOUT, remaining))
+                except asyncio.TimeoutError:
+                    if remaining > FFMPEG_STALL_TIMEOUT:
+                        print(
+                            f"ERROR: FFmpeg made no progress for {FFMPEG_STALL_TIMEOUT} seconds.")
+                    else:
+                        print(
+                            f"ERROR: FFmpeg ran longer than {FFMPEG_MAX_DURATION} seconds.")
+                    return 1, "Processing timeout"
+                if not line:
+                    break
+            await process.wait()
+        finally:
+            # timed out, or the task was cancelled (e.g. on shutdown) -
+            # don't leave ffmpeg running on its own
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
 
-        video_path = os.path.join(
-            temp_dir, f"{hash(metadata.title)}_video.tmp")
-        audio_path = os.path.join(
-            temp_dir, f"{hash(metadata.title)}_audio.tmp")
+        print(
+            f"DEBUG: FFmpeg process finished with return code {process.returncode}.")
+        stderr = ""
+        if process.returncode != 0:
+            errlog.seek(0)
+            stderr = errlog.read().decode(errors='replace')
+            print(f"ERROR: FFmpeg stderr:\n{stderr}")
+    return process.returncode, stderr
 
-        video, audio = get_best_streams(
-            metadata, video_quality, audio_quality)
 
-        if download_mode == "video_only":
-            audio = None
-            print("DEBUG: Download mode is 'video_only'. Ignoring audio stream.")
-        elif download_mode == "audio_only":
-            video = None
-            print("DEBUG: Download mode is 'audio_only'. Ignoring video stream.")
+async def _merge_direct(
+    metadata: SodaliteMetadata,
+    video: Optional[Video],
+    audio: Optional[Audio],
+    output_format: str,
+    output_path: str
+) -> bool:
+    """
+    let ffmpeg read the streams over http itself, so the bytes never take a
+    round trip through temp files. returns whether the merge succeeded
+    """
+    input_args = []
+    if video:
+        input_args.extend(_direct_input_args(video))
+    if audio:
+        input_args.extend(_direct_input_args(audio))
 
-        if not video and not audio:
-            raise ValueError("no video or audio streams available")
+    returncode, _ = await run_ffmpeg(build_ffmpeg_cmd(
+        input_args, metadata, video, audio,
+        output_format, output_path))
+    return returncode == 0
 
-        print(
-            f"DEBUG: Selected video stream: {video.quality if video else 'None'}")
-        print(
-            f"DEBUG: Selected audio stream: {audio.quality if audio else 'None'}")
 
-        if progress_callback:
-            progress_callback("downloading")
+async def _merge_from_temp_files(
+    scratch_dir: Optional[str],
+    job_id: str,
+    metadata: SodaliteMetadata,
+    video: Optional[Video],
+    audio: Optional[Audio],
+    output_format: str,
+    output_path: str,
+    progress_callback: Optional[Callable[[str], None]] = None
+) -> int:
+    """
+    download the streams to temp files under scratch_dir, then merge them.
+    returns the bytes downloaded
+    """
+    with tempfile.TemporaryDirectory(prefix="sodalite_", dir=scratch_dir) as temp_dir:
+        video_path = os.path.join(temp_dir, f"{job_id}_video.tmp")
+        audio_path = os.path.join(temp_dir, f"{job_id}_audio.tmp")
 
         download_tasks = []
-        if video and video.url:
+        if video:
             print(
                 f"DEBUG: Adding video download task for quality '{video.quality}'.")
-            download_tasks.append(download_stream(
-                str(video.url), video_path, video.headers))
-        if audio and audio.url:
+            download_tasks.append(("video", video_path, download_stream(
+                str(video.url), video_path, video.headers)))
+        if audio:
             print(
                 f"DEBUG: Adding audio download task for quality '{audio.quality}'.")
-            download_tasks.append(download_stream(
-                str(audio.url), audio_path, audio.headers))
+            download_tasks.append(("audio", audio_path, download_stream(
+                str(audio.url), audio_path, audio.headers)))
+
+        downloads = [asyncio.create_task(task) for _, _, task in download_tasks]
+        try:
+            results = await asyncio.gather(*downloads)
+        except BaseException:
+            # out of space (or cancelled), stop the other stream too
+            for download in downloads:
+                download.cancel()
+            await asyncio.gather(*downloads, return_exceptions=True)
+            raise
+        total_downloaded_bytes = sum(results)
+        print(
+            f"DEBUG: Download tasks finished. Total bytes downloaded: {total_downloaded_bytes}")
 
-        if download_tasks:
-            results = await asyncio.gather(*download_tasks)
-            total_downloaded_bytes = sum(results)
-            print(
-                f"DEBUG: Download tasks finished. Total bytes downloaded: {total_downloaded_bytes}")
-            if all(r == 0 for r in results):
-                raise RuntimeError("all streams failed to download")
+        # download_stream returns 0 on failure
+        failed = [
+            kind
+            for (kind, _, _), result in zip(download_tasks, results)
+            if result == 0
+        ]
+        if failed:
+            raise RuntimeError(
+                f"{' and '.join(failed)} stream failed to download")
 
         if progress_callback:
             progress_callback("processing")
 
-        ffmpeg_cmd = ["ffmpeg", "-y"]
-        if video:
-            ffmpeg_cmd.extend(["-i", video_path])
-        if audio:
-            ffmpeg_cmd.extend(["-i", audio_path])
+        input_args = []
+        for _, path, _ in download_tasks:
+            input_args.extend([*FFMPEG_INPUT_ARGS, "-i", path])
 
-        if video:
-            if output_format == "webm":
-                ffmpeg_cmd.extend(["-c:v", "libvpx-vp9"])
-            else:
-                ffmpeg_cmd.extend(["-c:v", "copy"])
-        if audio:
-            if output_format == "webm":
-                ffmpeg_cmd.extend(["-c:a", "libopus"])
-            elif output_format == "mp3":
-                ffmpeg_cmd.extend(["-c:a", "libmp3lame", "-b:a", "192k"])
-            else:
-                ffmpeg_cmd.extend(["-c:a", "aac", "-b:a", "192k"])
-
-        metadata_args = [
-            "-metadata", f"comment=Downloaded with sodalite from {metadata.service}",
-            "-metadata", f"encoder=sodalite"
-        ]
-        if metadata.title:
-            metadata_args.extend(["-metadata", f"title={metadata.title}"])
-        if metadata.author:
-            metadata_args.extend(["-metadata", f"artist={metadata.author}"])
-        ffmpeg_cmd.extend(metadata_args)
+        returncode, stderr = await run_ffmpeg(build_ffmpeg_cmd(
+            input_args, metadata, video, audio,
+            output_format, output_path))
 
-        if output_format == "mp4":
-            ffmpeg_cmd.extend(["-movflags", "+faststart"])
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg failed: {stderr}")
 
-        ffmpeg_cmd.append(output_path)
+    return total_downloaded_bytes
 
-        print(f"DEBUG: Executing FFmpeg command: {' '.join(ffmpeg_cmd)}")
 
-        def run_ffmpeg_sync():
-            try:
-                process = subprocess.run(
-                    ffmpeg_cmd,
-                    capture_output=True,
-                    text=True,
-                    timeout=300
-                )
-                print(
-                    f"DEBUG: FFmpeg process finished with return code {process.returncode}.")
-                if process.returncode != 0:
-                    print(f"ERROR: FFmpeg stderr:\n{process.stderr}")
-                return process.returncode, process.stderr
-            except subprocess.TimeoutExpired:
-                print("ERROR: FFmpeg process timed out after 5 minutes.")
-                return 1, "Processing timeout"
-            except Exception as e:
-                print(
-                    f"ERROR: An unexpected error occurred during FFmpeg execution: {e}")
-                return 1, f"Execution error: {str(e)}"
-
-        loop = asyncio.get_event_loop()
-        returncode, stderr = await loop.run_in_executor(None, run_ffmpeg_sync)
+async def download_and_merge(
+    metadata: SodaliteMetadata,
+    video_quality: Optional[str] = None,
+    audio_quality: Optional[str] = None,
+    output_format: str = "mp4",
+    output_dir: str = None,
+    download_mode: str = "default",
+    task_id: Optional[str] = None,
+    progress_callback: Optional[Callable[[str], None]] = None
+) -> tuple[str, str, int]:
+    """
+    download video and audio streams, merge them with ffmpeg, and inject metadata.
+    returns the output path, the filename to serve it as, and bytes downloaded
+    """
+    global _ffmpeg_path
+    if _ffmpeg_path is None:
+        _ffmpeg_path = shutil.which("ffmpeg")
+    if _ffmpeg_path is None:
+        raise RuntimeError(
+            "ffmpeg is not installed or not in PATH. please install ffmpeg.")
 
-        if returncode != 0:
-            raise RuntimeError(f"ffmpeg failed: {stderr}")
+    if output_dir is None:
+        output_dir = tempfile.gettempdir()
 
-        if progress_callback:
-            progress_callback("completed")
-        return output_path, total_downloaded_bytes
+    # concurrent jobs for the same title share output_dir, so every job
+    # gets its own id in the file names on disk. users get the plain name
+    job_id = uuid.uuid4().hex
+    base_filename = sanitize_filename(
+        f"{metadata.title}_{metadata.author}")
+    download_filename = f"{base_filename}.{output_format}"
+    output_filename = f"{base_filename}_{job_id[:8]}.{output_format}"
+    output_path = os.path.join(output_dir, output_filename)
+
+    video, audio = get_best_streams(
+        metadata, video_quality, audio_quality)
+
+    if download_mode == "video_only":
+        audio = None
+        print("DEBUG: Download mode is 'video_only'. Ignoring audio stream.")
+    elif download_mode == "audio_only":
+        video = None
+        print("DEBUG: Download mode is 'audio_only'. Ignoring video stream.")
+
+    if not video and not audio:
+        raise ValueError("no video or audio streams available")
+
+    print(
+        f"DEBUG: Selected video stream: {video.quality if video else 'None'}")
+    print(
+        f"DEBUG: Selected audio stream: {audio.quality if audio else 'None'}")
+
+    # every stream selected above has to make it into the output, a
+    # missing one would hand back a silent or blank file as a success
+    for kind, stream in (("video", video), ("audio", audio)):
+        if stream and not stream.url:
+            raise RuntimeError(f"selected {kind} stream has no url")
+
+    if progress_callback:
+        progress_callback("downloading")
+
+    try:
+        if _can_read_directly(video) and _can_read_directly(audio):
+            if progress_callback:
+                progress_callback("processing")
+            if await _merge_direct(
+                    metadata, video, audio, output_format, output_path):
+                # ffmpeg doesn't report input bytes, the output size is the
+                # closest measure of what came over the wire
+                total_downloaded_bytes = os.path.getsize(output_path)
+                if progress_callback:
+                    progress_callback("completed")
+                return output_path, download_filename, total_downloaded_bytes
+
+            print("WARNING: Direct ffmpeg input failed, falling back to temp file downloads.")
+            _remove_partial(output_path)
+            if progress_callback:
+                progress_callback("downloading")
+
+        scratch_dir = _scratch_dir()
+        try:
+            total_downloaded_bytes = await _merge_from_temp_files(
+                scratch_dir, job_id, metadata, video, audio,
+                output_format, output_path, progress_callback)
+        except OSError as e:
+            # /dev/shm only promised its free-space floor, a bigger stream
+            # goes back to the disk temp dir it used before
+            if scratch_dir is None or e.errno != errno.ENOSPC:
+                raise
+            print(
+                f"WARNING: Out of space in {scratch_dir}, retrying in {tempfile.gettempdir()}.")
+            if progress_callback:
+                progress_callback("downloading")
+            total_downloaded_bytes = await _merge_from_temp_files(
+                None, job_id, metadata, video, audio,
+                output_format, output_path, progress_callback)
+    except BaseException:
+        # whatever failed, a partial output would sit in output_dir with
+        # nothing scheduled to clean it up
+        _remove_partial(output_path)
+        raise
+
+    if progress_callback:
+        progress_callback("completed")
+    return output_path, download_filename, total_downloaded_bytes
@@ -0,0 +1,37 @@
+"""
+sodalite shared http session - one pooled aiohttp client for the whole process
+"""
+
+import aiohttp
+from typing import Optional
+
+_session: Optional[aiohttp.ClientSession] = None
+
+
+async def get_session() -> aiohttp.ClientSession:
+    """
+    returns the process-wide aiohttp session, creating it on first use
+    """
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=100,
+                ttl_dns_cache=300,
+                keepalive_timeout=60
+            ),
+            # don't let cookies from one user's request leak into the next
+            cookie_jar=aiohttp.DummyCookieJar(),
+            # let a response buffer up to 1 MiB before pausing the socket,
+            # matching the downloader's write size
+            read_bufsize=1024 * 1024
+        )
+    return _session
+
+
+async def close_session():
+    """closes the shared session, called on app shutdown"""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
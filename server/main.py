@@ -4,24 +4,27 @@ sodalite api server - the main entry point
 
 import os
 import tempfile
-import hashlib
-import json
+import secrets
+import orjson
 from datetime import datetime
-from pydantic.json import pydantic_encoder
 
 from fastapi import FastAPI, HTTPException, BackgroundTasks, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, Response
 from pydantic import BaseModel, HttpUrl
-from typing import Optional, Literal, List, Dict
+from typing import Optional, Literal, List, Dict, Tuple
 import git
 import asyncio
 import aiofiles
-import threading
+import aiofiles.os
+import heapq
 import time
+import traceback
 from contextlib import asynccontextmanager
+from cachetools import TTLCache
 from PIL import Image
 import io
+from dataclasses import dataclass
 
 from server.helper.detector import detect_service
 from server.helper.errors import (
@@ -36,26 +39,42 @@ from server.services import (
     tiktok
 )
 from server.helper.downloader import download_and_merge
-import aiohttp
+from server.helper.http import get_session, close_session
 
 download_semaphore = asyncio.Semaphore(2)
 DOWNLOAD_CLEANUP_DELAY_MINUTES = 5
+# finished tasks are forgotten this long after they complete or fail
+TASK_RETENTION_MINUTES = 60
 CACHE_DURATION = 30  # seconds
+STATS_FLUSH_INTERVAL = 5  # seconds
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # startup
     print("sodalite server starting up...")
-    global cleanup_task, stats_broadcast_task
+    global cleanup_task, stats_broadcast_task, file_cleanup_task, stats_flush_task
+    global git_info_cache, git_info_error
+    try:
+        git_info_cache = await asyncio.to_thread(read_git_info)
+    except Exception as e:
+        git_info_error = str(e)
     cleanup_task = asyncio.create_task(cleanup_stuck_tasks())
+    file_cleanup_task = asyncio.create_task(cleanup_expired_files())
+    stats_flush_task = asyncio.create_task(periodic_stats_flush())
     yield
     # shutdown
     print("sodalite server shutting down...")
     if cleanup_task and not cleanup_task.done():
         cleanup_task.cancel()
+    if file_cleanup_task and not file_cleanup_task.done():
+        file_cleanup_task.cancel()
+    if stats_flush_task and not stats_flush_task.done():
+        stats_flush_task.cancel()
+    await stats.flush()
     if stats_broadcast_task and not stats_broadcast_task.done():
         stats_broadcast_task.cancel()
+    await close_session()
 
 
 app = FastAPI(
@@ -99,6 +118,50 @@ class ProcessResponse(BaseModel):
     audio_quality: Optional[str] = None
 
 
+@dataclass(slots=True)
+class TaskRecord:
+    """server-side state for one download task"""
+    status: str
+    created_at: float  # epoch seconds, like the other timestamps here
+    url: str
+    service: str
+    video_quality: Optional[str] = None
+    audio_quality: Optional[str] = None
+    download_url: Optional[str] = None
+    file_path: Optional[str] = None
+    filename: Optional[str] = None
+    media_type: Optional[str] = None
+    error: Optional[str] = None
+    file_size_mb: Optional[float] = None
+    completed_at: Optional[float] = None
+    failed_at: Optional[float] = None
+    finished_at: Optional[float] = None  # epoch seconds, drives expiry
+
+
+class LargeChunkFileResponse(FileResponse):
+    """
+    file response that reads 1 MiB at a time instead of starlette's 64 KiB,
+    and bills the body bytes actually sent to outbound bandwidth - a range
+    request or a dropped connection only counts what went over the wire
+    """
+    chunk_size = 1024 * 1024
+
+    async def __call__(self, scope, receive, send):
+        sent_bytes = 0
+
+        async def counting_send(message):
+            nonlocal sent_bytes
+            await send(message)
+            if message["type"] == "http.response.body":
+                sent_bytes += len(message.get("body", b""))
+
+        try:
+            await super().__call__(scope, receive, counting_send)
+        finally:
+            if sent_bytes:
+                await record_outbound_bandwidth(sent_bytes)
+
+
 class ErrorResponse(BaseModel):
     error: str
     service: Optional[str] = None
@@ -118,28 +181,52 @@ DOWNLOAD_DIR = os.path.join(TEMP_DIR, "sodalite_downloads")
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 
 # global state
-tasks: Dict[str, Dict] = {}
+tasks: Dict[str, TaskRecord] = {}
 task_phases: Dict[str, str] = {}
-metadata_cache: Dict[str, Dict] = {}
-active_websockets: List[WebSocket] = []
+# keyed by url (HttpUrl caps it at 2083 chars), entries expire after
+# CACHE_DURATION and the cache evicts them itself
+metadata_cache: TTLCache = TTLCache(maxsize=10_000, ttl=CACHE_DURATION)
+# each socket's outbound queue, drained by its own websocket_writer task
+active_websockets: Dict[WebSocket, asyncio.Queue] = {}
+WEBSOCKET_QUEUE_SIZE = 16
 heartbeat_count: int = 0
+PING_MESSAGE = orjson.dumps({"type": "ping"}).decode()
+stats_message_cache: Optional[Tuple[tuple, str]] = None
+git_info_cache: Optional[dict] = None
+git_info_error: str = "not loaded"
 stats_broadcast_task: Optional[asyncio.Task] = None
 cleanup_task: Optional[asyncio.Task] = None
+file_cleanup_task: Optional[asyncio.Task] = None
+stats_flush_task: Optional[asyncio.Task] = None
 
 STATS_FILE = os.path.join(DOWNLOAD_DIR, "sodalite_stats.json")
 
+MEDIA_TYPE_MAP = {
+    ".mp4": "video/mp4",
+    ".webm": "video/webm",
+    ".mkv": "video/x-matroska",
+    ".mp3": "audio/mpeg",
+    ".m4a": "audio/mp4",
+    ".opus": "audio/opus",
+    ".flac": "audio/flac",
+    ".ogg": "audio/ogg",
+    ".wav": "audio/wav"
+}
+
 
 class Statistics:
     def __init__(self):
         self.total_conversions = 0
         self.total_bandwidth_bytes = 0
+        # set on every change, cleared once the change is on disk
+        self.dirty = False
         self.load_from_file()
 
     def load_from_file(self):
         try:
             if os.path.exists(STATS_FILE):
-                with open(STATS_FILE, 'r') as f:
-                    data = json.load(f)
+                with open(STATS_FILE, 'rb') as f:
+                    data = orjson.loads(f.read())
                     self.total_conversions = data.get('total_conversions', 0)
                     self.total_bandwidth_bytes = data.get(
                         'total_bandwidth_bytes', 0)
@@ -147,48 +234,98 @@ class Statistics:
             print(f"failed to load stats: {e}")
 
     async def save_to_file(self):
+        # cleared before the write so changes made while it runs aren't lost
+        self.dirty = False
         try:
             data = {
                 'total_conversions': self.total_conversions,
                 'total_bandwidth_bytes': self.total_bandwidth_bytes,
                 'last_updated': datetime.now().isoformat()
             }
-            async with aiofiles.open(STATS_FILE, 'w') as f:
-                await f.write(json.dumps(data, indent=2))
+            async with aiofiles.open(STATS_FILE, 'wb') as f:
+                await f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
         except Exception as e:
+            self.dirty = True
             print(f"failed to save stats: {e}")
 
+    async def flush(self):
+        """save to disk if anything changed since the last save"""
+        if self.dirty:
+            await self.save_to_file()
+
     async def increment_conversion(self):
         self.total_conversions += 1
-        await self.save_to_file()
+        self.dirty = True
 
     async def add_bandwidth(self, bytes_count: int):
         self.total_bandwidth_bytes += bytes_count
-        await self.save_to_file()
+        self.dirty = True
 
 
 stats = Statistics()
-file_cleanup_tasks = {}
-
-
-async def broadcast_stats():
-    if active_websockets:
-        message = json.dumps({
+# (expires_at, file_path) heap drained by cleanup_expired_files
+file_cleanup_heap: List[Tuple[float, str]] = []
+file_cleanup_event = asyncio.Event()
+
+
+def stats_message() -> str:
+    # sent as text frames, the frontend JSON.parses event.data as a string.
+    # the periodic broadcast usually finds nothing changed, so the encoded
+    # message is reused until one of the counters moves
+    global stats_message_cache
+    key = (heartbeat_count, len(active_websockets),
+           stats.total_conversions, stats.total_bandwidth_bytes)
+    if stats_message_cache is None or stats_message_cache[0] != key:
+        stats_message_cache = (key, orjson.dumps({
             "type": "stats",
             "heartbeats": heartbeat_count,
             "connected_clients": len(active_websockets),
             "total_conversions": stats.total_conversions,
             "total_bandwidth_mb": round(stats.total_bandwidth_bytes / (1024 * 1024), 2)
-        })
-        disconnected_websockets = []
-        for websocket in active_websockets:
-            try:
-                await websocket.send_text(message)
-            except Exception:
-                disconnected_websockets.append(websocket)
-        for websocket in disconnected_websockets:
-            if websocket in active_websockets:
-                active_websockets.remove(websocket)
+        }).decode())
+    return stats_message_cache[1]
+
+
+def queue_message(queue: asyncio.Queue, message: str):
+    """queue a frame for one client, dropping its oldest if it's fallen behind"""
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(message)
+
+
+def broadcast_stats():
+    # only hands the frame to each client's writer, so a slow client can't
+    # hold up the health check or the periodic broadcast
+    if active_websockets:
+        message = stats_message()
+        for queue in active_websockets.values():
+            queue_message(queue, message)
+
+
+async def websocket_writer(websocket: WebSocket, queue: asyncio.Queue):
+    """send queued frames to one client until it goes away"""
+    try:
+        while True:
+            await websocket.send_text(await queue.get())
+    except Exception:
+        # the receive loop in websocket_stats notices the disconnect and cleans up
+        active_websockets.pop(websocket, None)
+
+
+async def record_outbound_bandwidth(bytes_count: int):
+    """count a served file towards bandwidth and let clients know"""
+    await stats.add_bandwidth(bytes_count)
+    broadcast_stats()
+
+
+async def periodic_stats_flush():
+    """write stats to disk every few seconds instead of on every change"""
+    while True:
+        try:
+            await asyncio.sleep(STATS_FLUSH_INTERVAL)
+            await stats.flush()
+        except Exception as e:
+            print(f"error in periodic stats flush: {e}")
 
 
 async def periodic_stats_broadcast():
@@ -196,30 +333,11 @@ async def periodic_stats_broadcast():
     while True:
         try:
             await asyncio.sleep(10)
-            await broadcast_stats()
+            broadcast_stats()
         except Exception as e:
             print(f"error in periodic stats broadcast: {e}")
 
 
-def is_cache_valid(entry: dict) -> bool:
-    """check if cache entry is still valid (within 30 seconds)"""
-    cached_time = entry.get("cached_at")
-    if not cached_time:
-        return False
-    return time.time() - cached_time < CACHE_DURATION
-
-
-def clean_metadata_cache():
-    """remove expired cache entries"""
-    current_time = time.time()
-    expired_keys = [
-        key for key, data in metadata_cache.items()
-        if "timestamp" in data and current_time - data["timestamp"] > 30
-    ]
-    for key in expired_keys:
-        del metadata_cache[key]
-
-
 def sanitize_metadata_for_response(metadata: SodaliteMetadata) -> dict:
     """remove urls and headers from metadata before sending to client"""
     sanitized = {
@@ -246,54 +364,76 @@ def sanitize_metadata_for_response(metadata: SodaliteMetadata) -> dict:
 
 
 async def cleanup_stuck_tasks():
-    """clean up tasks that have been processing for too long"""
+    """fail tasks that have been processing for too long, forget old finished ones"""
     while True:
         try:
             await asyncio.sleep(60)  # check every minute
             current_time = time.time()
             stuck_tasks = []
+            expired_tasks = []
 
             for task_id, task_data in tasks.items():
-                if task_data.get("status") == "processing":
-                    created_at = task_data.get("created_at")
-                    if created_at:
-                        try:
-                            created_time = datetime.fromisoformat(
-                                created_at).timestamp()
-                            if current_time - created_time > 600:  # 10 minutes
-                                stuck_tasks.append(task_id)
-                        except:
-                            pass
+                if task_data.finished_at is not None:
+                    if current_time - task_data.finished_at > TASK_RETENTION_MINUTES * 60:
+                        expired_tasks.append(task_id)
+                elif task_data.status == "processing":
+                    if current_time - task_data.created_at > 600:  # 10 minutes
+                        stuck_tasks.append(task_id)
 
             for task_id in stuck_tasks:
                 print(f"cleaning up stuck task: {task_id}")
-                tasks[task_id].update({
-                    "status": "failed",
-                    "error": "task timeout - processing took too long"
-                })
+                task = tasks[task_id]
+                task.status = "failed"
+                task.error = "task timeout - processing took too long"
+                task.finished_at = current_time
+
+            # their files are long gone by now, cleanup_expired_files
+            # removes them after DOWNLOAD_CLEANUP_DELAY_MINUTES
+            for task_id in expired_tasks:
+                tasks.pop(task_id, None)
+                task_phases.pop(task_id, None)
 
         except Exception as e:
             print(f"error in cleanup task: {e}")
 
 
 def cleanup_file_after_delay(file_path: str, delay_minutes: int = 10):
-    def cleanup():
-        time.sleep(delay_minutes * 60)
+    """schedule a file for deletion, cleanup_expired_files does the work"""
+    heapq.heappush(file_cleanup_heap,
+                   (time.time() + delay_minutes * 60, file_path))
+    file_cleanup_event.set()
+
+
+async def cleanup_expired_files():
+    """delete scheduled files once their delay is up, soonest first"""
+    while True:
         try:
-            if os.path.exists(file_path):
-                os.remove(file_path)
+            file_cleanup_event.clear()
+            if not file_cleanup_heap:
+                await file_cleanup_event.wait()
+                continue
+
+            expires_at, file_path = file_cleanup_heap[0]
+            delay = expires_at - time.time()
+            if delay > 0:
+                # wake early if something new gets scheduled
+                try:
+                    await asyncio.wait_for(file_cleanup_event.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(file_cleanup_heap)
+            try:
+                await aiofiles.os.remove(file_path)
                 print(f"cleaned up file: {file_path}")
-            if file_path in file_cleanup_tasks:
-                del file_cleanup_tasks[file_path]
-        except Exception as e:
-            print(f"error cleaning up file {file_path}: {e}")
+            except FileNotFoundError:
+                pass  # already removed through the task delete endpoint
+            except Exception as e:
+                print(f"error cleaning up file {file_path}: {e}")
 
-    if file_path in file_cleanup_tasks:
-        pass
-
-    cleanup_thread = threading.Thread(target=cleanup, daemon=True)
-    cleanup_thread.start()
-    file_cleanup_tasks[file_path] = cleanup_thread
+        except Exception as e:
+            print(f"error in file cleanup task: {e}")
 
 
 SERVICE_HANDLERS = {
@@ -333,34 +473,23 @@ SERVICE_INFO = {
 }
 
 
-def generate_task_id(url: str) -> str:
-    timestamp = datetime.now().isoformat()
-    return hashlib.md5(f"{url}{timestamp}".encode()).hexdigest()
-
-
-def generate_cache_key(url: str) -> str:
-    return hashlib.md5(url.encode()).hexdigest()
+def generate_task_id() -> str:
+    # task ids are the only thing guarding /sodalite/download/{task_id}/file,
+    # so they come from the os csprng rather than anything derived from the url
+    return secrets.token_hex(16)
 
 
 def get_cached_metadata(url: str) -> Optional[SodaliteMetadata]:
     """get cached metadata if available and valid"""
-    cache_key = generate_cache_key(url)
-    if cache_key in metadata_cache:
-        entry = metadata_cache[cache_key]
-        if is_cache_valid(entry):
-            return SodaliteMetadata.model_validate(entry["metadata"])
-        else:
-            del metadata_cache[cache_key]
-    return None
+    entry = metadata_cache.get(url)
+    if entry is None:
+        return None
+    return SodaliteMetadata.model_validate(entry)
 
 
 def cache_metadata(url: str, metadata: SodaliteMetadata):
     """cache metadata for 30 seconds"""
-    cache_key = generate_cache_key(url)
-    metadata_cache[cache_key] = {
-        "metadata": metadata.model_dump(),
-        "cached_at": time.time()
-    }
+    metadata_cache[url] = metadata.model_dump()
 
 
 async def process_download_task(
@@ -373,13 +502,14 @@ async def process_download_task(
         print(f"phase update for {task_id}: {phase}")
         task_phases[task_id] = phase
 
+    task = tasks[task_id]
     async with download_semaphore:
         try:
             print(f"starting download task {task_id}")
-            tasks[task_id]["status"] = "processing"
+            task.status = "processing"
             task_phases[task_id] = "initializing"
 
-            output_path, downloaded_bytes = await download_and_merge(
+            output_path, filename, downloaded_bytes = await download_and_merge(
                 metadata=metadata,
                 video_quality=request.video_quality,
                 audio_quality=request.audio_quality,
@@ -393,15 +523,19 @@ async def process_download_task(
             await stats.add_bandwidth(downloaded_bytes)
 
             print(f"download task {task_id} completed successfully")
-            file_size_bytes = os.path.getsize(output_path)
+            file_size_bytes = await aiofiles.os.path.getsize(output_path)
             file_size_mb = round(file_size_bytes / (1024 * 1024), 2)
-            tasks[task_id].update({
-                "status": "completed",
-                "download_url": f"/sodalite/download/{task_id}/file",
-                "file_path": output_path,
-                "completed_at": datetime.now().isoformat(),
-                "file_size_mb": file_size_mb
-            })
+            task.status = "completed"
+            task.download_url = f"/sodalite/download/{task_id}/file"
+            task.file_path = output_path
+            # resolved once here rather than on every download of the file.
+            # the name on disk carries a job id, the served name doesn't
+            task.filename = filename
+            _, ext = os.path.splitext(output_path)
+            task.media_type = MEDIA_TYPE_MAP.get(
+                ext.lower(), "application/octet-stream")
+            task.file_size_mb = file_size_mb
+            task.completed_at = task.finished_at = time.time()
 
             if phase_callback:
                 phase_callback("completed")
@@ -413,13 +547,10 @@ async def process_download_task(
 
         except Exception as e:
             print(f"download task {task_id} failed: {str(e)}")
-            tasks[task_id].update({
-                "status": "failed",
-                "error": str(e),
-                "failed_at": datetime.now().isoformat()
-            })
+            task.status = "failed"
+            task.error = str(e)
+            task.failed_at = task.finished_at = time.time()
 
-            import traceback
             traceback.print_exc()
 
 
@@ -475,41 +606,42 @@ async def process_download(
     background_tasks: BackgroundTasks
 ):
     url_str = str(request.url)
-    service = detect_service(url_str)
-    if service == "unknown":
-        raise HTTPException(status_code=400, detail="unsupported service")
 
-    handler = SERVICE_HANDLERS.get(service)
-    if not handler:
-        raise HTTPException(status_code=500, detail="handler not found")
+    # entries live CACHE_DURATION seconds, far inside the lifetime of the
+    # signed stream urls, and carry the headers they were issued with - so
+    # the cached copy can be downloaded as-is. it only got cached after its
+    # service was detected, so a hit needs no detection either
+    metadata = get_cached_metadata(url_str)
+    if metadata:
+        print(f"using cached metadata for {url_str}")
+    else:
+        service = detect_service(url_str)
+        if service == "unknown":
+            raise HTTPException(status_code=400, detail="unsupported service")
 
-    try:
-        metadata = get_cached_metadata(url_str)
-        if not metadata:
+        handler = SERVICE_HANDLERS.get(service)
+        if not handler:
+            raise HTTPException(status_code=500, detail="handler not found")
+
+        try:
             print(f"no cache hit for {url_str}, fetching fresh metadata...")
             metadata = await handler(url_str)
             if metadata:
                 cache_metadata(url_str, metadata)
             else:
                 raise HTTPException(status_code=400, detail="failed to fetch metadata")
-        else:
-            print(f"using cached metadata for {url_str}")
-            # re-fetch to get fresh stream urls
-            metadata = await handler(url_str)
-
-
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
-
-    task_id = generate_task_id(url_str)
-    tasks[task_id] = {
-        "status": "processing",
-        "created_at": datetime.now().isoformat(),
-        "url": url_str,
-        "service": metadata.service,
-        "video_quality": request.video_quality,
-        "audio_quality": request.audio_quality,
-    }
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    task_id = generate_task_id()
+    tasks[task_id] = TaskRecord(
+        status="processing",
+        created_at=time.time(),
+        url=url_str,
+        service=metadata.service,
+        video_quality=request.video_quality,
+        audio_quality=request.audio_quality
+    )
     task_phases[task_id] = "initializing"
 
     background_tasks.add_task(
@@ -532,12 +664,12 @@ async def get_task_status(task_id: str):
 
     return ProcessResponse(
         task_id=task_id,
-        status=task["status"],
-        download_url=task.get("download_url"),
-        error=task.get("error"),
-        file_size_mb=task.get("file_size_mb"),
-        video_quality=task.get("video_quality"),
-        audio_quality=task.get("audio_quality")
+        status=task.status,
+        download_url=task.download_url,
+        error=task.error,
+        file_size_mb=task.file_size_mb,
+        video_quality=task.video_quality,
+        audio_quality=task.audio_quality
     )
 
 
@@ -552,7 +684,7 @@ async def get_task_phase(task_id: str):
     return {
         "task_id": task_id,
         "phase": phase,
-        "status": task["status"]
+        "status": task.status
     }
 
 
@@ -565,44 +697,29 @@ async def download_file(task_id: str):
             detail={"error": "task not found"}
         )
 
-    if task["status"] != "completed":
+    if task.status != "completed":
         raise HTTPException(
             status_code=400,
-            detail={"error": f"task is {task['status']}, not completed"}
+            detail={"error": f"task is {task.status}, not completed"}
         )
 
-    file_path = task.get("file_path")
-    if not file_path or not os.path.exists(file_path):
+    file_path = task.file_path
+    try:
+        # one stat serves both the existence check and the response
+        stat_result = os.stat(file_path) if file_path else None
+    except OSError:
+        stat_result = None
+    if stat_result is None:
         raise HTTPException(
             status_code=404,
             detail={"error": "file not found"}
         )
 
-    _, ext = os.path.splitext(file_path)
-    media_type_map = {
-        ".mp4": "video/mp4",
-        ".webm": "video/webm",
-        ".mkv": "video/x-matroska",
-        ".mp3": "audio/mpeg",
-        ".m4a": "audio/mp4",
-        ".opus": "audio/opus",
-        ".flac": "audio/flac",
-        ".ogg": "audio/ogg",
-        ".wav": "audio/wav"
-    }
-    media_type = media_type_map.get(ext.lower(), "application/octet-stream")
-
-    filename = os.path.basename(file_path)
-
-    # track outbound bandwidth
-    file_size = os.path.getsize(file_path)
-    await stats.add_bandwidth(file_size)
-    await broadcast_stats()
-
-    return FileResponse(
+    return LargeChunkFileResponse(
         file_path,
-        filename=filename,
-        media_type=media_type
+        filename=task.filename,
+        media_type=task.media_type,
+        stat_result=stat_result
     )
 
 
@@ -618,7 +735,7 @@ async def list_services():
 async def health_check():
     global heartbeat_count
     heartbeat_count += 1
-    await broadcast_stats()
+    broadcast_stats()
     return {
         "status": "ok",
         "heartbeats": heartbeat_count,
@@ -632,55 +749,51 @@ async def health_check():
 async def websocket_stats(websocket: WebSocket):
     global stats_broadcast_task
     await websocket.accept()
-    active_websockets.append(websocket)
+    queue = asyncio.Queue(maxsize=WEBSOCKET_QUEUE_SIZE)
+    active_websockets[websocket] = queue
+    writer_task = asyncio.create_task(websocket_writer(websocket, queue))
 
     if len(active_websockets) == 1 and (stats_broadcast_task is None or stats_broadcast_task.done()):
         stats_broadcast_task = asyncio.create_task(periodic_stats_broadcast())
 
     try:
-        await websocket.send_text(json.dumps({
-            "type": "stats",
-            "heartbeats": heartbeat_count,
-            "connected_clients": len(active_websockets),
-            "total_conversions": stats.total_conversions,
-            "total_bandwidth_mb": round(stats.total_bandwidth_bytes / (1024 * 1024), 2)
-        }))
+        queue_message(queue, stats_message())
 
         while True:
             try:
                 await asyncio.wait_for(websocket.receive_text(), timeout=30.0)
             except asyncio.TimeoutError:
-                await websocket.send_text(json.dumps({"type": "ping"}))
+                queue_message(queue, PING_MESSAGE)
             except WebSocketDisconnect:
                 break
     except Exception as e:
         print(f"websocket error: {e}")
     finally:
-        if websocket in active_websockets:
-            active_websockets.remove(websocket)
+        writer_task.cancel()
+        active_websockets.pop(websocket, None)
         if not active_websockets and stats_broadcast_task and not stats_broadcast_task.done():
             stats_broadcast_task.cancel()
 
 
+def read_git_info() -> dict:
+    repo = git.Repo(search_parent_directories=True)
+    branch = repo.active_branch.name
+    commit = repo.head.commit
+    return {
+        "branch": branch,
+        "commit_sha": commit.hexsha,
+        "commit_date": commit.committed_datetime.isoformat(),
+        "commit_message": commit.message.strip()
+    }
+
+
 @app.get("/sodalite/git-info")
 async def git_info():
-    try:
-        repo = git.Repo(search_parent_directories=True)
-        branch = repo.active_branch.name
-        commit = repo.head.commit
-        commit_sha = commit.hexsha
-        commit_date = commit.committed_datetime.isoformat()
-        commit_message = commit.message.strip()
-
-        return {
-            "branch": branch,
-            "commit_sha": commit_sha,
-            "commit_date": commit_date,
-            "commit_message": commit_message
-        }
-    except Exception as e:
+    # read once at startup, the checkout doesn't change under a running server
+    if git_info_cache is None:
         raise HTTPException(
-            status_code=500, detail=f"failed to get git info: {str(e)}")
+            status_code=500, detail=f"failed to get git info: {git_info_error}")
+    return git_info_cache
 
 
 @app.delete("/sodalite/task/{task_id}")
@@ -690,10 +803,12 @@ async def cleanup_task(task_id: str):
     if not task:
         raise HTTPException(status_code=404, detail="task not found")
 
-    file_path = task.get("file_path")
-    if file_path and os.path.exists(file_path):
+    file_path = task.file_path
+    if file_path:
         try:
-            os.remove(file_path)
+            await aiofiles.os.remove(file_path)
+        except FileNotFoundError:
+            pass
         except Exception as e:
             print(f"failed to remove file {file_path}: {e}")
 
@@ -705,33 +820,38 @@ async def cleanup_task(task_id: str):
 
     return {"message": "task cleaned up successfully"}
 
+def convert_image(image_data: bytes, save_format: str) -> bytes:
+    """decode an image and re-encode it as jpeg/png, runs off the event loop"""
+    image = Image.open(io.BytesIO(image_data))
+
+    # ensure image is in a format that can be saved to jpeg/png
+    if image.mode in ("RGBA", "P"):
+        image = image.convert("RGB")
+
+    buffer = io.BytesIO()
+    image.save(buffer, format=save_format)
+    return buffer.getvalue()
+
+
 @app.get("/sodalite/download/photo")
 async def download_photo(url: HttpUrl, format: str = "jpeg"):
     """download and convert a photo from a url"""
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(str(url)) as response:
-                response.raise_for_status()
-                image_data = await response.read()
-
-        image = Image.open(io.BytesIO(image_data))
+    save_format = format.upper()
+    if save_format not in ["JPEG", "PNG"]:
+        raise HTTPException(status_code=400, detail="unsupported image format")
 
-        # ensure image is in a format that can be saved to jpeg/png
-        if image.mode in ("RGBA", "P"):
-            image = image.convert("RGB")
-
-        buffer = io.BytesIO()
-        save_format = format.upper()
-        if save_format not in ["JPEG", "PNG"]:
-            raise HTTPException(status_code=400, detail="unsupported image format")
+    try:
+        session = await get_session()
+        async with session.get(str(url)) as response:
+            response.raise_for_status()
+            image_data = await response.read()
 
-        image.save(buffer, format=save_format)
-        buffer.seek(0)
+        body = await asyncio.to_thread(convert_image, image_data, save_format)
 
         media_type = f"image/{format}"
         filename = f"download.{format}"
 
-        return StreamingResponse(buffer, media_type=media_type, headers={"Content-Disposition": f"attachment; filename={filename}"})
+        return Response(body, media_type=media_type, headers={"Content-Disposition": f"attachment; filename={filename}"})
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"failed to download or convert photo: {str(e)}")
@@ -2,6 +2,7 @@
 metadata models for sodalite services
 """
 
+from functools import cached_property
 from pydantic import BaseModel, HttpUrl
 from typing import Dict, List, Optional
 
@@ -32,6 +33,16 @@ class SodaliteMetadata(BaseModel):
     videos: List[Video] = []
     audios: List[Audio] = []
 
+    @cached_property
+    def videos_by_quality(self) -> Dict[str, Video]:
+        """videos keyed by quality, the first one listed wins"""
+        return {video.quality: video for video in reversed(self.videos)}
+
+    @cached_property
+    def audios_by_quality(self) -> Dict[str, Audio]:
+        """audios keyed by quality, the first one listed wins"""
+        return {audio.quality: audio for audio in reversed(self.audios)}
+
 class SanitizedVideo(BaseModel):
     """a video download option without sensitive info"""
     quality: str
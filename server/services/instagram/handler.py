@@ -4,8 +4,8 @@ sodalite service for instagram
 
 from server.helper.errors import InstagramError
 from server.models.metadata import SodaliteMetadata, Video, Audio
+from server.helper.http import get_session
 from typing import Dict, Optional
-import aiohttp
 import re
 import json
 import xml.etree.ElementTree as ET
@@ -39,14 +39,14 @@ async def _get_raw_data(url: str, retry_count: int = 3) -> str:
 
     for attempt in range(retry_count):
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=headers) as response:
-                    if not response.ok:
-                        if attempt < retry_count - 1:
-                            await asyncio.sleep(1)  # Wait 1 second before retry
-                            continue
-                        raise InstagramError(f"failed to fetch data from {url}")
-                    return await response.text(encoding='utf-8', errors='ignore')
+            session = await get_session()
+            async with session.get(url, headers=headers) as response:
+                if not response.ok:
+                    if attempt < retry_count - 1:
+                        await asyncio.sleep(1)  # Wait 1 second before retry
+                        continue
+                    raise InstagramError(f"failed to fetch data from {url}")
+                return await response.text(encoding='utf-8', errors='ignore')
         except Exception as e:
             if attempt < retry_count - 1:
                 await asyncio.sleep(1)  # Wait 1 second before retry
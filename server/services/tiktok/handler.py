@@ -2,62 +2,65 @@
 sodalite service for tiktok
 """
 
-import aiohttp
-import json
-import re
-from typing import List, Optional, Dict, Tuple
+import orjson
+from typing import List, Optional, Dict, Set, Tuple
 
 # le shared modules
 from server.models.metadata import SodaliteMetadata, Video, Audio
 from server.helper.errors import TikTokError
+from server.helper.http import get_session
+
+_UNIVERSAL_DATA_TAG = '<script id="__UNIVERSAL_DATA_FOR_REHYDRATION__"'
+
+HEADERS = {
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Cache-Control': 'no-cache',
+    'DNT': '1',
+    'Pragma': 'no-cache',
+    'Sec-CH-UA': '"Google Chrome";v="137", "Chromium";v="137", "Not/A)Brand";v="24"',
+    'Sec-CH-UA-Mobile': '?0',
+    'Sec-CH-UA-Platform': '"Windows"',
+    'Sec-Fetch-Dest': 'document',
+    'Sec-Fetch-Mode': 'navigate',
+    'Sec-Fetch-Site': 'none',
+    'Sec-Fetch-User': '?1',
+    'Upgrade-Insecure-Requests': '1',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36'
+}
 
 async def _get_raw_data(url: str) -> Tuple[str, Dict[str, str]]:
-    headers = {
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
-        'Accept-Encoding': 'gzip, deflate, br',
-        'Accept-Language': 'en-US,en;q=0.9',
-        'Cache-Control': 'no-cache',
-        'DNT': '1',
-        'Pragma': 'no-cache',
-        'Sec-CH-UA': '"Google Chrome";v="137", "Chromium";v="137", "Not/A)Brand";v="24"',
-        'Sec-CH-UA-Mobile': '?0',
-        'Sec-CH-UA-Platform': '"Windows"',
-        'Sec-Fetch-Dest': 'document',
-        'Sec-Fetch-Mode': 'navigate',
-        'Sec-Fetch-Site': 'none',
-        'Sec-Fetch-User': '?1',
-        'Upgrade-Insecure-Requests': '1',
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36'
-    }
-
     cookies = {}
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, headers=headers) as response:
-            if not response.ok:
-                raise TikTokError(f"Failed to fetch data from {url}, status: {response.status}")
+    session = await get_session()
+    async with session.get(url, headers=HEADERS) as response:
+        if not response.ok:
+            raise TikTokError(f"Failed to fetch data from {url}, status: {response.status}")
 
-            # Extract cookies from response
-            for cookie in response.cookies.values():
-                cookies[cookie.key] = cookie.value
+        # Extract cookies from response
+        for cookie in response.cookies.values():
+            cookies[cookie.key] = cookie.value
 
-            return await response.text(encoding='utf-8', errors='ignore'), cookies
+        return await response.text(encoding='utf-8', errors='ignore'), cookies
 
 def _extract_json_from_raw_data(raw_data: str) -> dict:
     """
     extracts the main json data blob from the raw html
     """
     # drink water, stay hydrated
-    pattern = r'<script id="__UNIVERSAL_DATA_FOR_REHYDRATION__"[^>]*>(.*?)</script>'
-    match = re.search(pattern, raw_data, re.DOTALL)
+    # plain substring scans, the tag is a unique literal so no regex needed
+    tag_index = raw_data.find(_UNIVERSAL_DATA_TAG)
+    start = raw_data.find('>', tag_index) + 1 if tag_index >= 0 else -1
+    end = raw_data.find('</script>', start) if start > 0 else -1
 
-    if not match:
+    if end < 0:
         raise TikTokError("Could not find __UNIVERSAL_DATA_FOR_REHYDRATION__ script tag.")
 
-    json_str = match.group(1)
+    json_str = raw_data[start:end]
 
     try:
-        return json.loads(json_str)
-    except json.JSONDecodeError:
+        return orjson.loads(json_str)
+    except orjson.JSONDecodeError:
         raise TikTokError(f"Failed to parse JSON from the script tag.")
 
 def _parse_metadata_from_json(json_data: dict, cookies: Dict[str, str]) -> SodaliteMetadata:
@@ -78,16 +81,22 @@ def _parse_metadata_from_json(json_data: dict, cookies: Dict[str, str]) -> Sodal
     videos: List[Video] = []
     audios: List[Audio] = []
 
+    # every stream needs the same cookies, so build the header once
+    shared_headers = {
+        'Cookie': '; '.join(f"{k}={v}" for k, v in cookies.items())
+    } if cookies else None
+
     # extract audio-only stream (if available)
     if music_info.get("playUrl"):
         audios.append(Audio(
             url=music_info["playUrl"],
             quality="original", # tiktok doesn't tell us the bitrate :(
-            headers={
-                'Cookie': '; '.join([f"{k}={v}" for k, v in cookies.items()])
-            } if cookies else None
+            headers=shared_headers
         ))
 
+    # urls we've already added, so duplicates never make it into the list
+    seen_urls: Set[str] = set()
+
     # add other available bitrates (likely video-only for dash streams)
     bitrate_info_list = video_info.get("bitrateInfo", [])
     for bitrate_data in bitrate_info_list:
@@ -96,6 +105,9 @@ def _parse_metadata_from_json(json_data: dict, cookies: Dict[str, str]) -> Sodal
         # if no urls are available, skip this bitrate gng
         if not url_list:
             continue
+        if url_list[0] in seen_urls:
+            continue
+        seen_urls.add(url_list[0])
 
         # quality string
         height = play_addr.get("Height")
@@ -109,28 +121,24 @@ def _parse_metadata_from_json(json_data: dict, cookies: Dict[str, str]) -> Sodal
             quality=quality_str,
             width=width,
             height=height,
-            headers={
-                'Cookie': '; '.join([f"{k}={v}" for k, v in cookies.items()])
-            } if cookies else None
+            headers=shared_headers
         ))
 
     # extract video streams
     # the primary playaddr is often a good muxed stream ;P
     primary_download_url = video_info.get("downloadAddr")
-    if primary_download_url and not any(v.url == primary_download_url for v in videos):
+    if primary_download_url and primary_download_url not in seen_urls:
+        seen_urls.add(primary_download_url)
         videos.append(Video(
             url=primary_download_url,
             quality=f"{video_info.get('height')}p (muxed)", # muxed cuz its the primary download link
             width=video_info.get("width"),
             height=video_info.get("height"),
-            headers={
-                'Cookie': '; '.join([f"{k}={v}" for k, v in cookies.items()])
-            } if cookies else None
+            headers=shared_headers
         ))
 
-    # remove duplicates and sort videos by height desc.
-    unique_videos = {v.url: v for v in videos}.values()
-    videos = sorted(list(unique_videos), key=lambda v:v.height or 0, reverse=True)
+    # sort videos by height desc.
+    videos.sort(key=lambda v: v.height or 0, reverse=True)
 
     # other metadata
     author = author_info.get("nickname", "unknown")